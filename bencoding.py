@@ -8,6 +8,13 @@ TOKEN_DICT = b'd'
 TOKEN_END = b'e'
 TOKEN_STRING_SEPARATOR = b':'
 
+# Single-byte tokens as ints, for indexing into bytes without slicing
+_INTEGER = TOKEN_INTEGER[0]
+_LIST = TOKEN_LIST[0]
+_DICT = TOKEN_DICT[0]
+_END = TOKEN_END[0]
+_DIGITS = frozenset(b'0123456789')
+
 class Decoder:
     """
     Decodes bencoded binary data into Python objects.
@@ -23,32 +30,35 @@ class Decoder:
         """
         Decodes the bencoded data and returns the matching Python object.
         """
-        c = self._peek()
-        if c is None:
+        data = self._data
+        index = self._index
+        if index + 1 >= len(data):
             raise EOFError('Unexpected end of file')
-        elif c == TOKEN_INTEGER:
-            self._consume()  # eat 'i'
+        c = data[index]
+        # Strings are the most common value, check them first
+        if c in _DIGITS:
+            return self._decode_string()
+        elif c == _DICT:
+            self._index = index + 1  # eat 'd'
+            return self._decode_dict()
+        elif c == _INTEGER:
+            self._index = index + 1  # eat 'i'
             return self._decode_int()
-        elif c == TOKEN_LIST:
-            self._consume()  # eat 'l'
+        elif c == _LIST:
+            self._index = index + 1  # eat 'l'
             return self._decode_list()
-        elif c == TOKEN_DICT:
-            self._consume()  # eat 'd'
-            return self._decode_dict()
-        elif c in b'0123456789':
-            return self._decode_string()
-        elif c == TOKEN_END:
+        elif c == _END:
             return None
         else:
-            raise RuntimeError('Invalid token at index {}: {}'.format(self._index, c))
-
-    def _peek(self):
-        if self._index + 1 >= len(self._data):
-            return None
-        return self._data[self._index:self._index+1]
+            raise RuntimeError('Invalid token at index {}: {}'.format(index, data[index:index+1]))
 
-    def _consume(self):
-        self._index += 1
+    @property
+    def consumed(self) -> int:
+        """
+        Number of bytes decoded so far. After decode() this is where the
+        bencoded value ends, e.g. the start of a ut_metadata piece payload.
+        """
+        return self._index
 
     def _decode_int(self):
         end = self._data.find(TOKEN_END, self._index)
@@ -60,79 +70,85 @@ class Decoder:
         return int(number_string)
 
     def _decode_string(self):
-        colon = self._data.find(TOKEN_STRING_SEPARATOR, self._index)
+        data = self._data
+        colon = data.find(TOKEN_STRING_SEPARATOR, self._index)
         if colon == -1:
             raise RuntimeError('Invalid string: missing ":" separator')
         
-        length_string = self._data[self._index:colon]
+        length_string = data[self._index:colon]
         if not length_string.isdigit():
              raise RuntimeError('Invalid string length')
              
-        length = int(length_string)
-        self._index = colon + 1 # move past ':'
-        
-        string_data = self._data[self._index : self._index + length]
-        self._index += length
-        return string_data
+        start = colon + 1 # move past ':'
+        self._index = start + int(length_string)
+        return data[start : self._index]
+
+    def _at_end_token(self):
+        # Past the end counts as "not 'e'" so decode() raises EOFError
+        index = self._index
+        return index < len(self._data) and self._data[index] == _END
 
     def _decode_list(self):
         res = []
         # Recursive decode until we hit 'e'
-        while self._data[self._index:self._index+1] != TOKEN_END:
+        while not self._at_end_token():
             res.append(self.decode())
-        self._consume() # eat 'e'
+        self._index += 1 # eat 'e'
         return res
 
     def _decode_dict(self):
         res = OrderedDict()
-        while self._data[self._index:self._index+1] != TOKEN_END:
+        while not self._at_end_token():
             key = self.decode()
-            obj = self.decode()
-            res[key] = obj
-        self._consume() # eat 'e'
+            res[key] = self.decode()
+        self._index += 1 # eat 'e'
         return res
 
 class Encoder:
     """
     Encodes Python objects into bencoded binary data.
+    Output is collected into one list and joined once at the end.
     """
     def __init__(self, data):
         self._data = data
 
     def encode(self) -> bytes:
-        return self._encode_next(self._data)
-
-    def _encode_next(self, data):
-        if isinstance(data, int):
-            return self._encode_int(data)
+        out = []
+        self._encode_next(self._data, out)
+        return b''.join(out)
+
+    def _encode_next(self, data, out):
+        if isinstance(data, bytes):
+            self._encode_string(data, out)
+        elif isinstance(data, int):
+            self._encode_int(data, out)
         elif isinstance(data, str):
-            return self._encode_string(data.encode('utf-8'))
-        elif isinstance(data, bytes):
-            return self._encode_string(data)
+            self._encode_string(data.encode('utf-8'), out)
         elif isinstance(data, list):
-            return self._encode_list(data)
+            self._encode_list(data, out)
         elif isinstance(data, (dict, OrderedDict)):
-            return self._encode_dict(data)
+            self._encode_dict(data, out)
         else:
             # Fallback for unexpected types, treat as string or error
             raise TypeError('Cannot encode type: {}'.format(type(data)))
 
-    def _encode_int(self, value):
-        return str(value).encode('utf-8').join([TOKEN_INTEGER, TOKEN_END])
+    def _encode_int(self, value, out):
+        out.append(b'i%de' % value)
 
-    def _encode_string(self, value: bytes):
-        length = str(len(value)).encode('utf-8')
-        return length + TOKEN_STRING_SEPARATOR + value
+    def _encode_string(self, value: bytes, out):
+        out.append(b'%d:' % len(value))
+        out.append(value)
 
-    def _encode_list(self, data):
-        encoded = b''.join([self._encode_next(item) for item in data])
-        return TOKEN_LIST + encoded + TOKEN_END
+    def _encode_list(self, data, out):
+        out.append(TOKEN_LIST)
+        for item in data:
+            self._encode_next(item, out)
+        out.append(TOKEN_END)
 
-    def _encode_dict(self, data):
+    def _encode_dict(self, data, out):
         # Dictionary keys must be bencoded strings and sorted lexicographically
         # If it's an OrderedDict, we assume order is preserved, but standard spec 
         # requires sorted keys. We will sort standard dicts.
-        encoded_items = []
         
         # Ensure we are working with sorted keys if it's not an OrderedDict
         # Note: In strict Bencoding, keys must be strings/bytes.
@@ -140,9 +156,8 @@ class Encoder:
         if not isinstance(data, OrderedDict):
             keys.sort()
             
+        out.append(TOKEN_DICT)
         for key in keys:
-            encoded_key = self._encode_next(key)
-            encoded_val = self._encode_next(data[key])
-            encoded_items.append(encoded_key + encoded_val)
-            
-        return TOKEN_DICT + b''.join(encoded_items) + TOKEN_END
\ No newline at end of file
+            self._encode_next(key, out)
+            self._encode_next(data[key], out)
+        out.append(TOKEN_END)
@@ -6,7 +6,7 @@ from torrent import Torrent
 from tracker import Tracker
 from piece_manager import PieceManager
 from metadata import MetadataManager
-from peer import PeerConnection
+from peer import PeerConnection, PeerQueue
 from nat import NatTraverser
 from utp import UtpManager
 from kademlia import DHT
@@ -20,7 +20,7 @@ class TorrentClient:
         self.torrent = Torrent(torrent_file)
         self.tracker = Tracker(self.torrent)
         self.piece_manager = None 
-        self.peers_queue = asyncio.Queue()
+        self.peers_queue = PeerQueue()
         self.workers = []
         self.abort = False
         self.nat = NatTraverser()
@@ -65,7 +65,8 @@ class TorrentClient:
         # Phase 2: File Download
         print(f"Initializing Download: {self.torrent.output_file}")
         
-        self.piece_manager = PieceManager(self.torrent)
+        # The startup recheck can take minutes; keep DHT/UDP serviced meanwhile
+        self.piece_manager = await loop.run_in_executor(None, PieceManager, self.torrent)
         
         # Initialize Connection Manager
         self.conn_manager = ConnectionManager(self.piece_manager)
@@ -1,8 +1,17 @@
 import os
+import mmap
 import logging
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
+# Positional I/O: one syscall per chunk, no seek, no shared file position
+_HAS_PIO = hasattr(os, 'pwrite') and hasattr(os, 'preadv')
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+_HAS_PWRITEV = hasattr(os, 'pwritev')
+_HAS_MADVISE = hasattr(mmap.mmap, 'madvise') and hasattr(mmap, 'MADV_WILLNEED')
+MAX_WRITE_RUN = 64 # Buffers per pwritev; well under any platform's IOV_MAX
+
 class FileManager:
     """
     Manages reading and writing data across multiple files.
@@ -18,6 +27,7 @@ class FileManager:
         self.write_cache = {} 
         self.cache_size = 0
         self.CACHE_THRESHOLD = 64 * 1024 * 1024 
+        self._map_lock = threading.Lock() # Rechecks hash from several threads
         
         # We perform file opening synchronously on init to fail fast, 
         # but file creation is now sparse (fast).
@@ -36,11 +46,13 @@ class FileManager:
                     # Resize without writing bytes (Sparse)
                     f.truncate(tf.length)
             
-            # Open for Read/Write
-            f = open(tf.path, 'rb+')
+            # Open for Read/Write, unbuffered: whole pieces are already in memory
+            f = open(tf.path, 'rb+', buffering=0)
             self.file_handles.append({
                 'obj': f,
-                'info': tf
+                'info': tf,
+                'send': None, # Lazily opened read-only handle for sendfile
+                'map': None   # Lazily created read-only mapping for rechecks
             })
 
     def close(self):
@@ -50,6 +62,8 @@ class FileManager:
             self._flush_sync()
         for fh in self.file_handles:
             fh['obj'].close()
+            if fh['send']: fh['send'].close()
+            if fh['map'] is not None: fh['map'].close() # len() of a closed map raises
         self.io_executor.shutdown()
 
     async def write(self, global_offset: int, data: bytes):
@@ -72,15 +86,56 @@ class FileManager:
         """
         if not self.write_cache: return
         
-        sorted_offsets = sorted(self.write_cache.keys())
-        for offset in sorted_offsets:
+        # Adjacent pieces (sequential or end-game completion) are coalesced
+        # into runs that go out as one pwritev each
+        run_start, run_end, run = 0, 0, []
+        for offset in sorted(self.write_cache):
             data = self.write_cache[offset]
-            self._write_to_disk_sync(offset, data)
+            if run and offset == run_end and len(run) < MAX_WRITE_RUN:
+                run.append(data)
+            else:
+                if run: self._write_run_sync(run_start, run)
+                run_start, run = offset, [data]
+            run_end = offset + len(data)
+        if run: self._write_run_sync(run_start, run)
         
         self.write_cache.clear()
         self.cache_size = 0
 
+    def _write_run_sync(self, global_offset, buffers):
+        length = sum(len(data) for data in buffers)
+        fh = self._file_for(global_offset, length)
+        if _HAS_PWRITEV and len(buffers) > 1 and fh is not None:
+            file_offset = global_offset - fh['info'].start_offset
+            written = os.pwritev(fh['obj'].fileno(), buffers, file_offset)
+            if _HAS_FADVISE:
+                os.posix_fadvise(fh['obj'].fileno(), file_offset, written, os.POSIX_FADV_DONTNEED)
+            # Short write: the rest goes out buffer by buffer
+            for data in buffers:
+                if written >= len(data):
+                    written -= len(data)
+                else:
+                    self._write_to_disk_sync(global_offset + written, memoryview(data)[written:])
+                    written = 0
+                global_offset += len(data)
+            return
+        for data in buffers:
+            self._write_to_disk_sync(global_offset, data)
+            global_offset += len(data)
+
+    def _file_for(self, global_offset, length):
+        # The file holding the whole range, or None if it spans files
+        end = global_offset + length
+        for fh in self.file_handles:
+            tf = fh['info']
+            if tf.end_offset <= global_offset: continue
+            if tf.start_offset > global_offset or end > tf.end_offset: return None
+            return fh
+        return None
+
     def _write_to_disk_sync(self, global_offset, data):
+        # Slices of a view are written straight from the piece buffer
+        data = memoryview(data)
         bytes_to_write = len(data)
         current_global_pos = global_offset
         data_cursor = 0
@@ -98,9 +153,17 @@ class FileManager:
 
             chunk = data[data_cursor : data_cursor + amount_for_file]
 
-            f.seek(file_write_start)
-            f.write(chunk)
-            
+            pos = file_write_start
+            if not _HAS_PIO: f.seek(pos)
+            while chunk: # pwrite and raw (unbuffered) writes may write less than asked
+                n = os.pwrite(f.fileno(), chunk, pos) if _HAS_PIO else f.write(chunk)
+                chunk = chunk[n:]
+                pos += n
+            if _HAS_FADVISE:
+                # Flushed pieces are rarely read back soon: start writeback now and
+                # let the kernel drop the pages instead of evicting hotter ones
+                os.posix_fadvise(f.fileno(), file_write_start, amount_for_file, os.POSIX_FADV_DONTNEED)
+
             current_global_pos += amount_for_file
             data_cursor += amount_for_file
             bytes_to_write -= amount_for_file
@@ -116,14 +179,81 @@ class FileManager:
             if off <= global_offset < off + len(data):
                 start = global_offset - off
                 if start + length <= len(data):
-                    return data[start : start + length]
+                    # Zero-copy view; the cached piece is never mutated
+                    return memoryview(data)[start : start + length]
 
         # 2. Disk Read (Offload to thread)
         loop = asyncio.get_running_loop()
         return await loop.run_in_executor(self.io_executor, self._read_sync, global_offset, length)
 
+    def file_region(self, global_offset: int, length: int):
+        """
+        Locates a range for zero-copy sending (loop.sendfile).
+        Returns (file object, offset in file) if the range lies inside one
+        file and is already on disk, otherwise None.
+        The file object is a separate read-only handle that sendfile may
+        seek freely; the main handles stay with the I/O thread.
+        """
+        end = global_offset + length
+        for off, data in self.write_cache.items():
+            if off < end and global_offset < off + len(data): return None
+
+        fh = self._file_for(global_offset, length)
+        if fh is None: return None
+        if fh['send'] is None: fh['send'] = open(fh['info'].path, 'rb')
+        return fh['send'], global_offset - fh['info'].start_offset
+
+    def hash_range_sync(self, global_offset, length, hasher):
+        """
+        Feeds a range into hasher straight from memory-mapped files, without
+        a read buffer or copy (startup recheck). Returns the number of bytes
+        fed, which is short if a file on disk is smaller than expected.
+        """
+        fed = 0
+        end = global_offset + length
+        for fh in self.file_handles:
+            tf = fh['info']
+            if tf.end_offset <= global_offset + fed: continue
+            if tf.start_offset >= end: break
+
+            mm = self._mapping(fh)
+            if mm is None: break
+            start = global_offset + fed - tf.start_offset
+            # A file longer on disk than declared must not spill into the next one
+            stop = min(end - tf.start_offset, tf.length, len(mm))
+            if stop <= start: break
+            aligned = start - start % mmap.PAGESIZE
+            if _HAS_MADVISE:
+                # Queue readahead for the whole range up front, so the disk
+                # works on later pages while the first ones are hashed
+                mm.madvise(mmap.MADV_WILLNEED, aligned, stop - aligned)
+            with memoryview(mm)[start:stop] as view:
+                hasher.update(view)
+            if _HAS_FADVISE:
+                # Each byte is hashed once; drop it from the page cache as
+                # O_DIRECT would (unmap first, mapped pages are not evicted)
+                if _HAS_MADVISE: mm.madvise(mmap.MADV_DONTNEED, aligned, stop - aligned)
+                os.posix_fadvise(fh['obj'].fileno(), aligned, stop - aligned, os.POSIX_FADV_DONTNEED)
+            fed += stop - start
+            if stop < tf.length: break
+        return fed
+
+    def _mapping(self, fh):
+        if fh['map'] is None:
+            with self._map_lock:
+                if fh['map'] is None:
+                    f = fh['obj']
+                    if os.fstat(f.fileno()).st_size == 0: return None
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    if _HAS_MADVISE: mm.madvise(mmap.MADV_SEQUENTIAL)
+                    fh['map'] = mm
+        return fh['map']
+
     def _read_sync(self, global_offset, length):
-        response_data = bytearray()
+        # Each file reads into its slot of one buffer (no per-chunk bytes)
+        response_data = bytearray(length)
+        view = memoryview(response_data)
+        got = 0
         bytes_to_read = length
         current_global_pos = global_offset
 
@@ -138,13 +268,22 @@ class FileManager:
             file_remaining_cap = tf.length - file_read_start
             amount_for_file = min(bytes_to_read, file_remaining_cap)
 
-            f.seek(file_read_start)
-            chunk = f.read(amount_for_file)
-            response_data.extend(chunk)
+            target = view[got : got + amount_for_file]
+            n = 0
+            if not _HAS_PIO: f.seek(file_read_start)
+            while n < amount_for_file: # Reads may also return less than asked
+                if _HAS_PIO: r = os.preadv(f.fileno(), [target[n:]], file_read_start + n)
+                else: r = f.readinto(target[n:]) or 0
+                if not r: break # End of file
+                n += r
+            got += n
+            if n < amount_for_file: break # File shorter than expected
 
             current_global_pos += amount_for_file
             bytes_to_read -= amount_for_file
 
             if bytes_to_read <= 0: break
-        
-        return bytes(response_data)
\ No newline at end of file
+
+        view.release()
+        if got < length: del response_data[got:]
+        return response_data
\ No newline at end of file
@@ -170,13 +170,14 @@ class DHT(asyncio.DatagramProtocol):
             count = 0
             for v in values:
                 try:
-                    ip = socket.inet_ntoa(v[:4])
+                    if len(v) != 6: continue
+                    # Packed IP; PeerConnection formats it when dialing
                     port = struct.unpack(">H", v[4:])[0]
-                    self.peer_queue.put_nowait((ip, port))
+                    self.peer_queue.put_nowait((v[:4], port))
                     count += 1
                 except: pass
             if count > 0:
-                logging.info(f"DHT: Found {count} peers from {addr[0]}")
+                logging.info("DHT: Found %d peers from %s", count, addr[0])
 
     def _send_response(self, t, args, addr):
         msg = {b't': t, b'y': b'r', b'r': args}
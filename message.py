@@ -18,6 +18,9 @@ EXTENDED = 20 # BEP 10
 # Extension Handshake ID
 EXT_HANDSHAKE_ID = 0
 
+# Full REQUEST frame: <len=13><id=6><index><begin><length>
+REQUEST_PACK = struct.Struct(">IBIII").pack
+
 class PeerMessage:
     def __init__(self, msg_id, payload=b''):
         self.msg_id = msg_id
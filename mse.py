@@ -22,6 +22,9 @@ class EncryptedConnection:
         data = await self._reader.readexactly(n)
         return self.decryptor.process(data)
 
+    async def readstruct(self, st):
+        return st.unpack(await self.readexactly(st.size))
+
     async def read(self, n):
         data = await self._reader.read(n)
         return self.decryptor.process(data)
@@ -30,6 +33,10 @@ class EncryptedConnection:
         encrypted = self.encryptor.process(data)
         self._writer.write(encrypted)
 
+    def writelines(self, data):
+        # RC4 is a stream cipher, so buffers must be processed in order
+        self._writer.writelines([self.encryptor.process(chunk) for chunk in data])
+
     async def drain(self):
         await self._writer.drain()
 
@@ -3,9 +3,59 @@ import struct
 import socket
 import logging
 import time
+import os
 import message
 from bencoding import Decoder, Encoder
 from mse import perform_mse_handshake
+from peer_stream import PeerStream
+
+_HAS_SENDFILE = hasattr(os, 'sendfile')
+
+PIPELINE_DEPTH = 5 # Outstanding REQUESTs per peer
+IDLE_TIMEOUT = 120 # Seconds without incoming bytes before dropping a peer
+PREFIX_TIMEOUT = 1 # Seconds to finish a length prefix that straddled an idle timeout
+STATS_WINDOW = 10.0 # Seconds between tick_stats() calls (choker interval)
+# Largest frame accepted: a 16KB block plus headers, or the bitfield of a
+# torrent with up to ~2M pieces. Anything bigger is a broken or hostile peer.
+MAX_MSG = 256 * 1024
+WRITE_BUFFER_HIGH = 256 * 1024
+WRITE_BUFFER_LOW = 64 * 1024
+
+# What a malformed bencoded extension payload can raise while being read
+_BAD_PAYLOAD = (RuntimeError, EOFError, TypeError, ValueError, KeyError, AttributeError)
+
+# Handshake starts with <pstrlen=19><pstr>
+_PROTOCOL_PREFIX = b'\x13BitTorrent protocol'
+
+# Compact peer format (BEP 23): 4-byte IPv4 + 2-byte port
+_COMPACT_PEER = struct.Struct(">4sH")
+
+# Message header: <len><id>
+_MSG_HEADER = struct.Struct(">IB")
+# PIECE header: <len><id=7><index><begin>, block data follows
+_PIECE_HEADER = struct.Struct(">IBII")
+# Payload fields: PIECE <index><begin>, REQUEST <index><begin><length>
+_INDEX_BEGIN = struct.Struct(">II")
+_REQUEST_FIELDS = struct.Struct(">III")
+
+# Frames that never change, encoded once
+_INTERESTED_FRAME = message.PeerMessage(message.INTERESTED).encode()
+_UNCHOKE_FRAME = message.PeerMessage(message.UNCHOKE).encode()
+_CHOKE_FRAME = message.PeerMessage(message.CHOKE).encode()
+_EXT_HANDSHAKE_FRAME = message.ExtendedHandshake().encode()
+
+def _untimed(aw): return aw
+def _timed(aw): return asyncio.wait_for(aw, timeout=IDLE_TIMEOUT)
+
+class PeerQueue(asyncio.Queue):
+    """
+    Peer address queue that tracks which addresses a worker is currently
+    connected to, so a peer re-announced by PEX/DHT/tracker is not dialed
+    a second time.
+    """
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.connected = set()
 
 class PeerConnection:
     def __init__(self, queue, manager, info_hash, peer_id, 
@@ -24,10 +74,12 @@ class PeerConnection:
         
         self.reader = None
         self.writer = None
+        self._stream = None # Underlying PeerStream, even when MSE wraps it
         self.ip = None
         self.port = None
         
         self.remote_extensions = {} 
+        self._ext_by_id = {}
         self.supports_extensions = False
         self.remote_metadata_size = 0
         
@@ -38,41 +90,80 @@ class PeerConnection:
         self.peer_interested = False  
         self.am_choking = True        
         self.am_interested = False    
+        self.requests_in_flight = 0
+        # The transport rejects writes while loop.sendfile() runs. Frames from
+        # other tasks wait here, and a choke change waits in _held_choke.
+        self._sendfile_active = False
+        self._held_frames = []
+        self._held_choke = None
 
-        self.last_data_recv = time.time()
+        self.last_data_recv = time.monotonic()
         self.is_snubbed = False
+        # Bytes moved in the current / last completed choker window
         self.download_window = 0
         self.upload_window = 0
-        self.download_rate = 0.0
-        self.upload_rate = 0.0
+        self._download_last = 0
+        self._upload_last = 0
+
+        # Message ID -> bound handler. Metadata mode only speaks BEP 10/9.
+        if self.is_metadata_mode:
+            self._dispatch = {message.EXTENDED: self._on_extended}
+        else:
+            self._dispatch = {
+                message.CHOKE: self._on_choke,
+                message.UNCHOKE: self._on_unchoke,
+                message.INTERESTED: self._on_interested,
+                message.NOT_INTERESTED: self._on_not_interested,
+                message.HAVE: self._on_have,
+                message.BITFIELD: self._on_bitfield,
+                message.REQUEST: self._on_request,
+                message.PIECE: self._on_piece,
+                message.EXTENDED: self._on_extended,
+            }
 
     def tick_stats(self):
-        self.download_rate = self.download_window / 10.0
-        self.upload_rate = self.upload_window / 10.0
-        self.download_window = 0
-        self.upload_window = 0
-        if time.time() - self.last_data_recv > 60: self.is_snubbed = True
-        else: self.is_snubbed = False
+        self._download_last, self.download_window = self.download_window, 0
+        self._upload_last, self.upload_window = self.upload_window, 0
+        self.is_snubbed = time.monotonic() - self.last_data_recv > 60
+
+    # Rates are only needed when the choker sorts peers
+    @property
+    def download_rate(self): return self._download_last / STATS_WINDOW
+
+    @property
+    def upload_rate(self): return self._upload_last / STATS_WINDOW
 
     def unchoke(self):
-        if self.am_choking: asyncio.create_task(self._send_unchoke())
+        if (self.am_choking or self._sendfile_active) and self.writer: self._send_unchoke()
 
     def choke(self):
-        if not self.am_choking: asyncio.create_task(self._send_choke())
+        if (not self.am_choking or self._sendfile_active) and self.writer: self._send_choke()
 
     async def run(self):
         while True:
             try:
                 self.ip, self.port = await self.queue.get()
             except asyncio.CancelledError: break
+            # PEX/DHT queue packed addresses; only dialed peers get formatted
+            if isinstance(self.ip, bytes): self.ip = socket.inet_ntoa(self.ip)
+            addr = (self.ip, self.port)
+            connected = getattr(self.queue, 'connected', None)
+            if connected is not None:
+                # Another worker already holds a session with this peer
+                if addr in connected:
+                    self.queue.task_done()
+                    continue
+                connected.add(addr)
             try:
                 await self._connect_and_loop()
             except asyncio.CancelledError:
                 self.stop()
+                if connected is not None: connected.discard(addr)
                 self.queue.task_done()
                 raise 
             except Exception as e: pass
             self.stop()
+            if connected is not None: connected.discard(addr)
             self.queue.task_done()
 
     async def _connect_and_loop(self):
@@ -91,56 +182,88 @@ class PeerConnection:
             
             if self.conn_manager: self.conn_manager.add_connection(self)
 
+            await self._send_opening_messages()
             if self.supports_extensions:
-                await self._send_extended_handshake()
                 self.pex_task = asyncio.create_task(self._pex_heartbeat())
             
-            if not self.is_metadata_mode: await self._send_interested()
-            
-            async for msg in self._message_iterator():
-                await self._handle_message(msg)
+            await self._read_loop()
                 
-        except (asyncio.TimeoutError, ConnectionError, OSError): pass
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError): pass
         except asyncio.CancelledError: raise
-        except Exception as e: logging.error(f"Error {self.ip}: {e}")
+        except Exception as e: logging.error("Error %s: %s", self.ip, e)
 
     async def _establish_socket(self):
-        self.reader, self.writer = await asyncio.wait_for(
-            asyncio.open_connection(self.ip, self.port), timeout=10
+        loop = asyncio.get_running_loop()
+        _, stream = await asyncio.wait_for(
+            loop.create_connection(lambda: PeerStream(IDLE_TIMEOUT), self.ip, self.port), timeout=10
         )
+        # One object serves as both ends, like EncryptedConnection
+        self.reader = self.writer = self._stream = stream
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            # Control messages are 5-17 bytes; don't let Nagle hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if hasattr(socket, 'TCP_QUICKACK'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            # Keep NAT state alive on quiet connections
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15)
+        # Bound per-peer buffering: drain() suspends once 256KB is queued.
+        # Several pipelined 16KB PIECEs fit before it does.
+        self.writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH, low=WRITE_BUFFER_LOW)
 
     async def _perform_handshake(self):
         hs = message.Handshake(self.info_hash, self.my_peer_id)
+        # 68 bytes never trips the write buffer limit; go straight to the read
         self.writer.write(hs.encode())
-        await self.writer.drain()
         data = await self.reader.readexactly(68)
-        if data[1:20] != b'BitTorrent protocol': raise ValueError("Unknown protocol")
+        # Fixed-offset checks without slicing: <19>'BitTorrent protocol'<reserved><info_hash><peer_id>
+        if not data.startswith(_PROTOCOL_PREFIX): raise ValueError("Unknown protocol")
         if data[25] & 0x10: self.supports_extensions = True
-        if data[28:48] != self.info_hash: raise ValueError("Info hash mismatch")
+        if not data.startswith(self.info_hash, 28): raise ValueError("Info hash mismatch")
         self.remote_peer_id = data[48:]
 
-    async def _send_extended_handshake(self):
-        msg = message.ExtendedHandshake()
-        self.writer.write(msg.encode())
-        await self.writer.drain()
+    async def _send_opening_messages(self):
+        # Extended handshake and INTERESTED leave in a single write/drain
+        out = []
+        if self.supports_extensions: out.append(_EXT_HANDSHAKE_FRAME)
+        if not self.is_metadata_mode:
+            out.append(_INTERESTED_FRAME)
+            self.am_interested = True
+        if out:
+            self.writer.write(b''.join(out))
+            await self.writer.drain()
 
-    async def _send_interested(self):
-        msg = message.PeerMessage(message.INTERESTED)
-        self.writer.write(msg.encode())
-        await self.writer.drain()
-        self.am_interested = True
+    # Control frames are a few bytes and never approach the write buffer's
+    # high-water mark, so they are written without awaiting drain().
+    # drain() is kept for connection setup and PIECE uploads.
 
-    async def _send_unchoke(self):
-        self.am_choking = False
-        msg = message.PeerMessage(message.UNCHOKE)
-        self.writer.write(msg.encode())
-        await self.writer.drain()
+    def _send_unchoke(self):
+        if self._sendfile_active: self._held_choke = False
+        else:
+            self.writer.write(_UNCHOKE_FRAME)
+            self.am_choking = False
 
-    async def _send_choke(self):
-        self.am_choking = True
-        msg = message.PeerMessage(message.CHOKE)
-        self.writer.write(msg.encode())
-        await self.writer.drain()
+    def _send_choke(self):
+        if self._sendfile_active: self._held_choke = True
+        else:
+            self.writer.write(_CHOKE_FRAME)
+            self.am_choking = True
+
+    def _write_frame(self, frame):
+        if self._sendfile_active: self._held_frames.append(frame)
+        else: self.writer.write(frame)
+
+    def _flush_held(self):
+        # Runs once sendfile has returned; am_choking follows what was sent
+        frames, self._held_frames = self._held_frames, []
+        choking, self._held_choke = self._held_choke, None
+        if choking is not None and choking != self.am_choking:
+            frames.append(_CHOKE_FRAME if choking else _UNCHOKE_FRAME)
+            self.am_choking = choking
+        if frames: self.writer.writelines(frames)
 
     async def _pex_heartbeat(self):
         while True:
@@ -155,107 +278,145 @@ class PeerConnection:
     def _send_pex_message(self, added_peers):
         added_binary = b''
         for ip, port in added_peers:
-            try: added_binary += socket.inet_aton(ip) + struct.pack(">H", port)
-            except: pass
+            try: added_binary += _COMPACT_PEER.pack(socket.inet_aton(ip), port)
+            except (OSError, struct.error): pass
         flags = b'\x00' * len(added_peers)
         payload = {b'added': added_binary, b'added.f': flags}
         encoded_payload = Encoder(payload).encode()
         ext_id = self.remote_extensions[b'ut_pex']
         msg = message.ExtendedMessage(ext_id, encoded_payload)
-        self.writer.write(msg.encode())
+        self._write_frame(msg.encode())
 
-    async def _message_iterator(self):
+    async def _read_loop(self):
+        # Hot receive path: frame and dispatch without building message objects.
+        # Length and ID are read together; keep-alives (length 0) are rare, so
+        # the extra byte they swallow is carried over as the next header's start.
+        reader = self.reader
+        dispatch = self._dispatch
+        # PeerStream/EncryptedConnection unpack the header without a bytes object
+        readstruct = getattr(reader, 'readstruct', None)
+        # PeerStream enforces the idle timeout itself, arming a timer only when
+        # a read has to wait. Other readers need a wait_for (a Task) per read.
+        if self._stream is not None: timed = _untimed
+        else: timed = _timed
+        pending = b''
         while True:
             try:
-                length_data = await asyncio.wait_for(self.reader.readexactly(4), timeout=120)
-                length = struct.unpack(">I", length_data)[0]
-                if length == 0: continue
-                id_data = await asyncio.wait_for(self.reader.readexactly(1), timeout=120)
-                msg_id = id_data[0]
-                payload_length = length - 1
-                payload = b''
-                if payload_length > 0:
-                    payload = await asyncio.wait_for(self.reader.readexactly(payload_length), timeout=120)
-                yield message.PeerMessage(msg_id, payload)
-            except Exception: break
-
-    async def _handle_message(self, msg):
-        if msg.msg_id == message.EXTENDED:
-            await self._handle_extended_message(msg.payload)
-            return
-        if self.is_metadata_mode: return
-
-        if msg.msg_id == message.CHOKE: self.peer_choking = True
-        elif msg.msg_id == message.UNCHOKE:
-            self.peer_choking = False
-            await self._request_piece()
-        elif msg.msg_id == message.INTERESTED:
-            self.peer_interested = True
-            if self.conn_manager is None: await self._send_unchoke()
-        elif msg.msg_id == message.NOT_INTERESTED: self.peer_interested = False
-        elif msg.msg_id == message.HAVE:
-            index = struct.unpack(">I", msg.payload)[0]
-            self.manager.update_peer(self.remote_peer_id, index)
-        elif msg.msg_id == message.BITFIELD:
-            self.manager.add_peer(self.remote_peer_id, msg.payload, self.ip, self.port)
-            await self._request_piece()
-        elif msg.msg_id == message.REQUEST:
-            index, begin, length = struct.unpack(">III", msg.payload)
-            await self._handle_request(index, begin, length)
-        elif msg.msg_id == message.PIECE:
-            index = struct.unpack(">I", msg.payload[0:4])[0]
-            begin = struct.unpack(">I", msg.payload[4:8])[0]
-            block_data = msg.payload[8:]
-            self.download_window += len(block_data)
-            self.last_data_recv = time.time()
-            self.manager.block_received(self.remote_peer_id, index, begin, block_data)
-            await self._request_piece()
-
-    async def _handle_extended_message(self, payload):
+                if readstruct and not pending:
+                    length, msg_id = await timed(readstruct(_MSG_HEADER))
+                else:
+                    header = pending + await timed(reader.readexactly(5 - len(pending)))
+                    length, msg_id = _MSG_HEADER.unpack(header)
+            except asyncio.TimeoutError:
+                header = await self._read_header_after_idle(pending)
+                if header is None:
+                    pending = b''
+                    continue
+                length, msg_id = _MSG_HEADER.unpack(header)
+            if length == 0:
+                pending = bytes((msg_id,))
+                continue
+            if length > MAX_MSG:
+                raise ConnectionError("Oversized message (%d bytes)" % length)
+            pending = b''
+            payload = b''
+            if length > 1:
+                payload = await timed(reader.readexactly(length - 1))
+            handler = dispatch.get(msg_id)
+            if handler: await handler(payload)
+
+    async def _read_header_after_idle(self, pending):
+        # A trailing keep-alive never completes a 5-byte read. Consume just the
+        # length prefix so it still counts as activity; None means keep-alive.
+        prefix = pending + await asyncio.wait_for(self.reader.readexactly(4 - len(pending)), timeout=PREFIX_TIMEOUT)
+        if prefix == b'\x00\x00\x00\x00': return None
+        return prefix + await asyncio.wait_for(self.reader.readexactly(1), timeout=IDLE_TIMEOUT)
+
+    async def _on_extended(self, payload):
+        self._handle_extended_message(payload)
+
+    async def _on_choke(self, payload):
+        self.peer_choking = True
+        # Peer drops queued requests on choke; the manager re-issues them on timeout
+        self.requests_in_flight = 0
+
+    async def _on_unchoke(self, payload):
+        self.peer_choking = False
+        self._request_piece()
+
+    async def _on_interested(self, payload):
+        self.peer_interested = True
+        if self.conn_manager is None: self._send_unchoke()
+
+    async def _on_not_interested(self, payload):
+        self.peer_interested = False
+
+    async def _on_have(self, payload):
+        if len(payload) != 4: raise ConnectionError("Malformed HAVE")
+        index = int.from_bytes(payload, 'big')
+        self.manager.update_peer(self.remote_peer_id, index)
+
+    async def _on_bitfield(self, payload):
+        self.manager.add_peer(self.remote_peer_id, payload, self.ip, self.port)
+        self._request_piece()
+
+    async def _on_request(self, payload):
+        index, begin, length = _REQUEST_FIELDS.unpack(payload)
+        await self._handle_request(index, begin, length)
+
+    async def _on_piece(self, payload):
+        index, begin = _INDEX_BEGIN.unpack_from(payload)
+        # View over the owned payload: skips a second copy of every block
+        block_data = memoryview(payload)[8:]
+        self.download_window += len(block_data)
+        if self.requests_in_flight: self.requests_in_flight -= 1
+        self.last_data_recv = time.monotonic()
+        self.manager.block_received(self.remote_peer_id, index, begin, block_data)
+        self._request_piece()
+
+    def _handle_extended_message(self, payload):
         ext_id = payload[0]
         data = payload[1:]
         if ext_id == 0: self._handle_ext_handshake(data)
         else:
-            ext_name = None
-            for name, remote_id in self.remote_extensions.items():
-                if remote_id == ext_id:
-                    ext_name = name
-                    break
+            ext_name = self._ext_by_id.get(ext_id)
             if ext_name == b'ut_pex': self._handle_pex(data)
-            elif ext_name == b'ut_metadata': await self._handle_ut_metadata(data)
+            elif ext_name == b'ut_metadata': self._handle_ut_metadata(data)
 
     def _handle_ext_handshake(self, data):
         try:
             handshake_dict = Decoder(data).decode()
-            if b'm' in handshake_dict: self.remote_extensions = handshake_dict[b'm']
-            if b'metadata_size' in handshake_dict:
-                self.remote_metadata_size = handshake_dict[b'metadata_size']
-                if self.is_metadata_mode:
-                    self.manager.set_size(self.remote_metadata_size)
-                    asyncio.create_task(self._request_metadata_piece())
-            self.manager.add_peer(self.remote_peer_id, [], self.ip, self.port)
-        except Exception: pass
+            if b'm' in handshake_dict:
+                remote_extensions = handshake_dict[b'm']
+                ext_by_id = {v: k for k, v in remote_extensions.items() if isinstance(v, int)}
+                self.remote_extensions, self._ext_by_id = remote_extensions, ext_by_id
+            metadata_size = handshake_dict.get(b'metadata_size')
+        except _BAD_PAYLOAD: return
+        if metadata_size is not None:
+            self.remote_metadata_size = metadata_size
+            if self.is_metadata_mode: self.manager.set_size(metadata_size)
+        self.manager.add_peer(self.remote_peer_id, [], self.ip, self.port)
+        # Sent inline from the connection's task, no extra task needed
+        if metadata_size is not None and self.is_metadata_mode: self._request_metadata_piece()
 
     def _handle_pex(self, data):
         try:
             pex_dict = Decoder(data).decode()
             if b'added' in pex_dict: self._parse_and_add_peers(pex_dict[b'added'])
-        except Exception: pass
+        except _BAD_PAYLOAD: pass
 
-    async def _handle_ut_metadata(self, data):
+    def _handle_ut_metadata(self, data):
         try:
             decoder = Decoder(data)
             msg_dict = decoder.decode()
             msg_type = msg_dict[b'msg_type']
             piece_index = msg_dict[b'piece']
-            if msg_type == 1: 
-                payload = decoder._data[decoder._index:]
-                if self.is_metadata_mode:
-                    self.manager.receive_data(piece_index, payload)
-                    if not self.manager.complete: await self._request_metadata_piece()
-        except Exception: pass
-
-    async def _request_metadata_piece(self):
+        except _BAD_PAYLOAD: return
+        if msg_type == 1 and self.is_metadata_mode:
+            self.manager.receive_data(piece_index, data[decoder.consumed:])
+            if not self.manager.complete: self._request_metadata_piece()
+
+    def _request_metadata_piece(self):
         if not self.is_metadata_mode or not self.manager.active: return
         if b'ut_metadata' not in self.remote_extensions: return
         index = self.manager.get_next_request()
@@ -265,42 +426,74 @@ class PeerConnection:
             ext_id = self.remote_extensions[b'ut_metadata']
             msg = message.ExtendedMessage(ext_id, encoded_req)
             self.writer.write(msg.encode())
-            await self.writer.drain()
 
     def _parse_and_add_peers(self, binary_data):
-        peer_size = 6
-        if len(binary_data) % peer_size != 0: return
-        for i in range(0, len(binary_data), peer_size):
-            chunk = binary_data[i : i + peer_size]
-            ip = socket.inet_ntoa(chunk[:4])
-            port = struct.unpack(">H", chunk[4:])[0]
-            try: self.queue.put_nowait((ip, port))
-            except Exception: pass
+        if len(binary_data) % _COMPACT_PEER.size != 0: return
+        # Queued as (packed 4-byte IP, port); run() formats it when dialing
+        for peer in _COMPACT_PEER.iter_unpack(binary_data):
+            try: self.queue.put_nowait(peer)
+            except asyncio.QueueFull: break
 
     async def _handle_request(self, index, begin, length):
         if self.am_choking or length > 32768: return
+        # Plain TCP with the block on disk: let the kernel copy file -> socket
+        if _HAS_SENDFILE and isinstance(self.writer, PeerStream):
+            source = self.manager.block_source(index, begin, length)
+            if source:
+                await self._sendfile_block(index, begin, length, *source)
+                return
         # NEW: Await the async read
         block_data = await self.manager.read_block(index, begin, length)
         if block_data:
             self.upload_window += len(block_data)
-            payload = struct.pack(">II", index, begin) + block_data
-            msg = message.PeerMessage(message.PIECE, payload)
-            self.writer.write(msg.encode())
+            # Header and block are handed over together; 3.12+ transports send them
+            # without joining, older ones concatenate before the write
+            header = _PIECE_HEADER.pack(9 + len(block_data), message.PIECE, index, begin)
+            self.writer.writelines((header, block_data))
             await self.writer.drain()
 
-    async def _request_piece(self):
+    async def _sendfile_block(self, index, begin, length, f, offset):
+        self.upload_window += length
+        self.writer.write(_PIECE_HEADER.pack(9 + length, message.PIECE, index, begin))
+        self._sendfile_active = True
+        try:
+            try:
+                await asyncio.get_running_loop().sendfile(self.writer.transport, f, offset, length, fallback=False)
+            except asyncio.SendfileNotAvailableError:
+                # Header is already out, so the body must follow it
+                block_data = await self.manager.read_block(index, begin, length)
+                if not block_data or len(block_data) != length: raise ConnectionError("Cannot complete PIECE")
+                self.writer.write(block_data)
+        finally: self._sendfile_active = False
+        self._flush_held()
+        await self.writer.drain()
+
+    def _request_piece(self):
         if self.peer_choking: return
-        block = self.manager.next_request(self.remote_peer_id)
-        if block:
-            req = message.Request(block.piece_index, block.offset, block.length)
-            self.writer.write(req.encode())
-            await self.writer.drain()
+        # Keep the pipeline full and send the whole batch in one write
+        frames = []
+        requested = set()
+        while self.requests_in_flight < PIPELINE_DEPTH:
+            block = self.manager.next_request(self.remote_peer_id)
+            if not block: break
+            key = (block.piece_index, block.offset)
+            # End game hands back the same pending block again
+            if key in requested: break
+            requested.add(key)
+            frames.append(message.REQUEST_PACK(13, message.REQUEST, block.piece_index, block.offset, block.length))
+            self.requests_in_flight += 1
+        if frames: self.writer.writelines(frames)
 
     def stop(self):
+        self.requests_in_flight = 0
+        # Frames held back by a sendfile that failed die with the connection
+        self._held_frames.clear()
+        self._held_choke = None
         if self.conn_manager: self.conn_manager.remove_connection(self)
         if self.pex_task: self.pex_task.cancel()
         if self.remote_peer_id: self.manager.remove_peer(self.remote_peer_id)
         if self.writer:
             try: self.writer.close()
             except Exception: pass
-        self.writer = None
\ No newline at end of file
+        self.writer = None
+        self._stream = None
\ No newline at end of file
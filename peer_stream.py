@@ -0,0 +1,167 @@
+import asyncio
+
+RECV_BUFFER_SIZE = 64 * 1024   # Initial per-peer receive buffer
+RECV_MIN_FREE = 4 * 1024       # Compact/grow when less than this is free at the tail
+RECV_HIGH_WATER = 256 * 1024   # Pause the socket when this much is unread
+
+class PeerStream(asyncio.BufferedProtocol):
+    """
+    Combined reader/writer for a peer TCP connection.
+    The transport receives straight into one reusable bytearray (recv_into),
+    instead of StreamReader allocating a bytes object per recv and copying
+    it into its own growing buffer.
+    Exposes the subset of the StreamReader/StreamWriter API used by
+    PeerConnection and the MSE handshake.
+    """
+    def __init__(self, read_timeout=None):
+        self.transport = None
+        # Max seconds a read may wait for new bytes; only armed when it has to wait
+        self.read_timeout = read_timeout
+        self._buf = bytearray(RECV_BUFFER_SIZE)
+        self._start = 0 # First unread byte
+        self._end = 0   # End of received data
+        self._eof = False
+        self._exc = None
+        self._connection_lost = False
+        self._read_waiter = None
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiters = []
+
+    # --- Protocol callbacks ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self._connection_lost = True
+        self._eof = True
+        self._exc = exc
+        self._wake_reader()
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                if exc: waiter.set_exception(exc)
+                else: waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    def get_buffer(self, sizehint):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif len(self._buf) - self._end < RECV_MIN_FREE:
+            # Move the unread tail to the front, grow only if that is not enough
+            unread = self._end - self._start
+            self._buf[:unread] = self._buf[self._start:self._end]
+            self._start, self._end = 0, unread
+            if len(self._buf) - unread < RECV_MIN_FREE:
+                self._buf.extend(bytes(len(self._buf)))
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        self._end += nbytes
+        self._wake_reader()
+        if not self._reading_paused and self._end - self._start > RECV_HIGH_WATER:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def eof_received(self):
+        self._eof = True
+        self._wake_reader()
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        for waiter in self._drain_waiters:
+            if not waiter.done(): waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    # --- Reader API ---
+
+    async def readexactly(self, n):
+        await self._fill(n)
+        start = self._start
+        self._start += n
+        data = bytes(memoryview(self._buf)[start:self._start])
+        self._maybe_resume_reading()
+        return data
+
+    async def readstruct(self, st):
+        """
+        Reads st.size bytes and unpacks them in place, without creating a
+        bytes object (used for the fixed message header).
+        """
+        await self._fill(st.size)
+        values = st.unpack_from(self._buf, self._start)
+        self._start += st.size
+        self._maybe_resume_reading()
+        return values
+
+    async def _fill(self, n):
+        while self._end - self._start < n:
+            if self._exc: raise self._exc
+            if self._eof:
+                partial = bytes(self._buf[self._start:self._end])
+                self._start = self._end
+                raise asyncio.IncompleteReadError(partial, n)
+            await self._wait_for_data()
+
+    async def read(self, n):
+        if self._start == self._end:
+            if self._exc: raise self._exc
+            if self._eof: return b''
+            await self._wait_for_data()
+        start = self._start
+        self._start = min(self._end, start + n)
+        data = bytes(memoryview(self._buf)[start:self._start])
+        self._maybe_resume_reading()
+        return data
+
+    async def _wait_for_data(self):
+        # A caller waiting for more than the high-water mark must not stay paused
+        if self._reading_paused:
+            self._reading_paused = False
+            self.transport.resume_reading()
+        loop = asyncio.get_running_loop()
+        waiter = self._read_waiter = loop.create_future()
+        timer = None
+        if self.read_timeout is not None:
+            timer = loop.call_later(self.read_timeout, self._read_timed_out, waiter)
+        try: await waiter
+        finally:
+            self._read_waiter = None
+            if timer: timer.cancel()
+
+    def _read_timed_out(self, waiter):
+        if not waiter.done(): waiter.set_exception(asyncio.TimeoutError())
+
+    def _wake_reader(self):
+        if self._read_waiter and not self._read_waiter.done():
+            self._read_waiter.set_result(None)
+
+    def _maybe_resume_reading(self):
+        if self._reading_paused and self._end - self._start <= RECV_HIGH_WATER // 2:
+            self._reading_paused = False
+            self.transport.resume_reading()
+
+    # --- Writer API ---
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    async def drain(self):
+        # Even a clean close: writes would never be resumed (as StreamWriter.drain)
+        if self._connection_lost: raise ConnectionResetError('Connection lost')
+        if not self._writing_paused: return
+        waiter = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def close(self):
+        self.transport.close()
@@ -4,55 +4,145 @@ import hashlib
 import logging
 import os
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from file_manager import FileManager
 
 BLOCK_SIZE = 2 ** 14
 
+# Positions (MSB first) of the set bits of every byte value
+_SET_BITS = [tuple(bit for bit in range(8) if (byte >> (7 - bit)) & 1) for byte in range(256)]
+
 class Block:
+    """
+    A 16KB request within a piece. The status lives in the owning piece's
+    statuses bytearray, so scheduler scans over a piece are C-level
+    bytearray searches rather than attribute loads per Block.
+    """
+    # One per 16KB of the torrent: no per-instance __dict__
+    __slots__ = ('piece_index', 'offset', 'length', '_statuses', '_slot')
     Missing = 0
     Pending = 1
     Retrieved = 2
 
-    def __init__(self, piece: int, offset: int, length: int):
+    def __init__(self, piece: int, offset: int, length: int, statuses: bytearray = None, slot: int = 0):
         self.piece_index = piece
         self.offset = offset
         self.length = length
-        self.status = Block.Missing
-        self.data = None
+        # Pieces pass their shared statuses; a standalone block gets its own
+        self._statuses = bytearray(1) if statuses is None else statuses
+        self._slot = slot
+
+    @property
+    def status(self): return self._statuses[self._slot]
+
+    @status.setter
+    def status(self, value): self._statuses[self._slot] = value
 
 class Piece:
-    def __init__(self, index: int, blocks: list, hash_value: bytes):
+    __slots__ = ('index', 'is_complete', 'byte_offset', 'length', 'num_blocks',
+                 '_blocks', '_statuses', '_buf', '_sha1', '_hashed')
+
+    def __init__(self, index: int, length: int, byte_offset: int = 0):
         self.index = index
-        self.blocks = blocks
-        self.hash = hash_value
+        self.byte_offset = byte_offset # Start of the piece in the torrent's data
         self.is_complete = False
+        self.length = length
+        self.num_blocks = -(-length // BLOCK_SIZE)
+        # Blocks and their statuses are built when the piece is first
+        # scheduled; pieces restored from disk never need them
+        self._blocks = None
+        self._statuses = None
+        # Whole-piece buffer and running SHA-1 (over blocks in offset order).
+        # Both exist only while the piece is being downloaded.
+        self._buf = None
+        self._sha1 = None
+        self._hashed = 0
+
+    @property
+    def blocks(self):
+        if self._blocks is None: self._build_blocks()
+        return self._blocks
+
+    @property
+    def statuses(self):
+        # Block i's status is statuses[i]
+        if self._statuses is None: self._build_blocks()
+        return self._statuses
+
+    def _build_blocks(self):
+        status = Block.Retrieved if self.is_complete else Block.Missing
+        self._statuses = statuses = bytearray((status,)) * self.num_blocks
+        self._blocks = []
+        for i in range(self.num_blocks):
+            offset = i * BLOCK_SIZE
+            self._blocks.append(Block(self.index, offset, min(BLOCK_SIZE, self.length - offset), statuses, i))
 
     def reset(self):
         self.is_complete = False
-        for block in self.blocks:
-            block.status = Block.Missing
-            block.data = None
+        self.release()
+        self._hashed = 0
+        if self._statuses is not None: self._statuses[:] = bytes(self.num_blocks)
+
+    def release(self):
+        self._buf = None
+        self._sha1 = None
+
+    def mark_retrieved(self):
+        if self._statuses is not None:
+            self._statuses[:] = bytes((Block.Retrieved,)) * self.num_blocks
+
+    def store(self, block, data):
+        if self._buf is None:
+            self._buf = bytearray(self.length)
+            self._sha1 = hashlib.sha1()
+        self._buf[block.offset:block.offset + block.length] = data
+        self.statuses[block._slot] = Block.Retrieved
+
+    def hash_received(self):
+        # Feed every block that is now contiguous with the hashed prefix.
+        # Out-of-order blocks simply wait until the gap before them is filled.
+        blocks, statuses = self.blocks, self.statuses
+        view = memoryview(self._buf)
+        while self._hashed < self.num_blocks and statuses[self._hashed] == Block.Retrieved:
+            block = blocks[self._hashed]
+            self._sha1.update(view[block.offset:block.offset + block.length])
+            self._hashed += 1
+
+    def digest(self):
+        if self._hashed < self.num_blocks: return None
+        return self._sha1.digest()
 
     @property
     def data(self):
-        if any(b.data is None for b in self.blocks): return None
-        sorted_blocks = sorted(self.blocks, key=lambda b: b.offset)
-        return b''.join([b.data for b in sorted_blocks])
+        if self._hashed < self.num_blocks: return None
+        return self._buf
 
 class PieceManager:
     def __init__(self, torrent):
         self.torrent = torrent
         self.peers = {} 
         self.active_peers = {}
-        self.pending_blocks = [] 
-        self.missing_pieces = [] 
-        self.ongoing_pieces = [] 
+        self.pending_blocks = {} # (piece index, offset) -> (block, request time)
+        self.missing_pieces = {} # index -> Piece; index order, failed pieces first
+        self.ongoing_pieces = {} # index -> Piece
         self.have_pieces = []    
+        self._have_set = set() # Indices of have_pieces, for upload lookups
+        self._have_mask = 0    # Same, in wire bitfield layout (resume data)
         self.downloaded_bytes = 0 
         self.resume_file = f"{self.torrent.info_hash.hex()}.resume"
+        self._piece_length = torrent.piece_length # Used on every upload request
+        # All piece SHA-1s in one blob; piece i's is _hash_of(i)
+        self._piece_hashes = b''.join(torrent.pieces)
         
         self._initiate_pieces_structure()
         self.total_pieces = len(self.missing_pieces)
+        # Peer bitfields are kept as ints in wire order: piece i is bit (_top - i)
+        self._bitfield_len = math.ceil(self.total_pieces / 8)
+        self._top = self._bitfield_len * 8 - 1
+        self._all_mask = ((1 << self.total_pieces) - 1) << (self._bitfield_len * 8 - self.total_pieces)
+        self._missing_mask = self._all_mask # Same layout: pieces in missing_pieces
+        self._rarity = [0] * self.total_pieces # piece index -> non-seed peers that have it
+        self._seed_ids = set() # Peers whose bitfield had every piece; counted once, not per piece
         
         self.file_manager = FileManager(self.torrent)
         self._restore_state()
@@ -63,21 +153,13 @@ class PieceManager:
 
     def _initiate_pieces_structure(self):
         total_length = self.torrent.total_size
-        piece_length = self.torrent.piece_length
+        piece_length = self._piece_length
         num_pieces = math.ceil(total_length / piece_length)
         
         for index in range(num_pieces):
             start = index * piece_length
-            end = min(start + piece_length, total_length)
-            this_piece_length = end - start
-            num_blocks = math.ceil(this_piece_length / BLOCK_SIZE)
-            blocks = []
-            for b_idx in range(num_blocks):
-                b_start = b_idx * BLOCK_SIZE
-                b_end = min(b_start + BLOCK_SIZE, this_piece_length)
-                b_length = b_end - b_start
-                blocks.append(Block(index, b_start, b_length))
-            self.missing_pieces.append(Piece(index, blocks, self.torrent.pieces[index]))
+            this_piece_length = min(piece_length, total_length - start)
+            self.missing_pieces[index] = Piece(index, this_piece_length, start)
 
     def _restore_state(self):
         if os.path.exists(self.resume_file):
@@ -92,143 +174,215 @@ class PieceManager:
 
     def _load_fast_resume(self):
         with open(self.resume_file, 'rb') as f: bitfield = f.read()
-        pieces_to_move = []
-        for i, piece in enumerate(self.missing_pieces):
-            if (bitfield[i // 8] >> (7 - (i % 8))) & 1: pieces_to_move.append(piece)
-        for piece in pieces_to_move:
-            piece.is_complete = True
-            for block in piece.blocks: block.status = Block.Retrieved
-            self.have_pieces.append(piece)
-            self.downloaded_bytes += self._get_piece_length(piece.index)
-        for piece in pieces_to_move: self.missing_pieces.remove(piece)
+        if len(bitfield) < self._bitfield_len: raise ValueError("Resume bitfield too short")
+        # Walk only the set bits; missing_pieces still holds every piece here
+        pieces, total = self.missing_pieces, self.total_pieces
+        self._restore_pieces([pieces[i * 8 + bit]
+                              for i, byte in enumerate(bitfield[:self._bitfield_len]) if byte
+                              for bit in _SET_BITS[byte] if i * 8 + bit < total])
 
     def _hash_check(self):
-        confirmed = []
-        for piece in list(self.missing_pieces):
-            data = self.file_manager._read_sync(piece.index * self.torrent.piece_length, self._get_piece_length(piece.index))
-            if data and hashlib.sha1(data).digest() == piece.hash:
-                piece.is_complete = True
-                for block in piece.blocks: block.status = Block.Retrieved
-                confirmed.append(piece)
-                self.downloaded_bytes += len(data)
-        for piece in confirmed:
-            self.missing_pieces.remove(piece)
+        pieces = list(self.missing_pieces.values())
+        # hashlib releases the GIL while hashing (and while faulting in the
+        # mapped file), so pieces are checked on every core
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            results = list(pool.map(self._check_piece, pieces))
+        self._restore_pieces([piece for piece, ok in zip(pieces, results) if ok])
+
+    def _restore_pieces(self, pieces):
+        # Pieces already complete on disk
+        found = bytearray(self._bitfield_len)
+        for piece in pieces:
+            del self.missing_pieces[piece.index]
+            piece.is_complete = True
+            piece.mark_retrieved()
             self.have_pieces.append(piece)
+            self._have_set.add(piece.index)
+            self.downloaded_bytes += piece.length
+            found[piece.index >> 3] |= 0x80 >> (piece.index & 7)
+        if not pieces: return
+        found = int.from_bytes(found, 'big')
+        self._missing_mask &= ~found
+        self._have_mask |= found
+
+    def _check_piece(self, piece):
+        # Runs on a worker thread: only reads the piece and the files
+        sha1 = hashlib.sha1()
+        fed = self.file_manager.hash_range_sync(piece.byte_offset, piece.length, sha1)
+        return fed == piece.length and sha1.digest() == self._hash_of(piece.index)
 
     def save_resume_data(self):
         if not self.have_pieces: return
-        bf = bytearray(math.ceil(self.total_pieces / 8))
-        for p in self.have_pieces: bf[p.index // 8] |= (1 << (7 - (p.index % 8)))
         try: 
             with open(self.resume_file, 'wb') as f: 
-                f.write(bf)
+                f.write(self._have_mask.to_bytes(self._bitfield_len, 'big'))
             logging.info("Resume data saved.")
         except Exception: 
             pass
 
-    def _get_piece_length(self, index):
-        if index == self.total_pieces - 1:
-            r = self.torrent.total_size % self.torrent.piece_length
-            return r if r > 0 else self.torrent.piece_length
-        return self.torrent.piece_length
-
     def add_peer(self, peer_id, bitfield, ip=None, port=None):
-        self.peers[peer_id] = set()
-        for i, byte in enumerate(bitfield):
-            for bit in range(8):
-                if (byte >> (7 - bit)) & 1:
-                    idx = i * 8 + bit
-                    if idx < self.total_pieces: self.peers[peer_id].add(idx)
+        if peer_id in self.peers: self._uncount_peer(peer_id)
+        n = self._bitfield_len
+        bitfield = bitfield[:n]
+        # Short bitfields are zero-padded; spare bits past the last piece dropped
+        mask = (int.from_bytes(bitfield, 'big') << (8 * (n - len(bitfield)))) & self._all_mask
+        self.peers[peer_id] = mask
+        # Seeds add the same count to every piece, which never changes which
+        # piece is rarest, so they skip the per-piece rollup entirely
+        if mask == self._all_mask: self._seed_ids.add(peer_id)
+        else: self._count_pieces(mask, 1)
         if ip and port: self.active_peers[peer_id] = (ip, port)
 
+    def _count_pieces(self, mask, delta):
+        # Adds delta to the rarity of every piece set in a peer mask
+        rarity = self._rarity
+        for i, byte in enumerate(mask.to_bytes(self._bitfield_len, 'big')):
+            if byte:
+                base = i * 8
+                for bit in _SET_BITS[byte]: rarity[base + bit] += delta
+
+    def _uncount_peer(self, peer_id):
+        mask = self.peers.pop(peer_id)
+        if peer_id in self._seed_ids: self._seed_ids.discard(peer_id)
+        else: self._count_pieces(mask, -1)
+
+    def availability(self, index):
+        return self._rarity[index] + len(self._seed_ids)
+
     def remove_peer(self, peer_id):
         if peer_id in self.active_peers: del self.active_peers[peer_id]
-        if peer_id in self.peers: del self.peers[peer_id]
+        if peer_id in self.peers: self._uncount_peer(peer_id)
 
     def get_active_peers(self): return list(self.active_peers.values())
     
     def update_peer(self, peer_id, index):
-        if peer_id in self.peers: self.peers[peer_id].add(index)
-        else: self.peers[peer_id] = {index}
+        if not 0 <= index < self.total_pieces: return
+        bit = 1 << (self._top - index)
+        mask = self.peers.get(peer_id, 0)
+        if not mask & bit:
+            self.peers[peer_id] = mask | bit
+            self._rarity[index] += 1
 
     @property
     def end_game_mode(self):
         return len(self.missing_pieces) < 5 or len(self.missing_pieces) < (self.total_pieces * 0.01)
 
     def next_request(self, peer_id):
-        peer_pieces = self.peers.get(peer_id, set())
-        current_time = time.time()
-        for i, (block, request_time) in enumerate(self.pending_blocks):
-            if current_time - request_time > 5:
-                if block.piece_index in peer_pieces:
-                    self.pending_blocks[i] = (block, current_time)
+        mask = self.peers.get(peer_id, 0)
+        top = self._top
+        current_time = time.monotonic()
+        pending = self.pending_blocks
+        # Entries stay in request order (a re-request moves its entry to the
+        # back), so the sweep stops at the first one that has not expired
+        for key, (block, request_time) in pending.items():
+            if current_time - request_time <= 5: break
+            if (mask >> (top - block.piece_index)) & 1:
+                del pending[key]
+                pending[key] = (block, current_time)
+                return block
+        for piece in self.ongoing_pieces.values():
+            if (mask >> (top - piece.index)) & 1:
+                i = piece.statuses.find(Block.Missing)
+                if i >= 0:
+                    piece.statuses[i] = Block.Pending
+                    block = piece.blocks[i]
+                    self.pending_blocks[(piece.index, block.offset)] = (block, current_time)
                     return block
-        for piece in self.ongoing_pieces:
-            if piece.index in peer_pieces:
-                for block in piece.blocks:
-                    if block.status == Block.Missing:
-                        block.status = Block.Pending
-                        self.pending_blocks.append((block, current_time))
-                        return block
         if self.end_game_mode:
-            for piece in self.ongoing_pieces:
-                if piece.index in peer_pieces:
-                    for block in piece.blocks:
-                        if block.status == Block.Pending: return block
-        candidates = [p for p in self.missing_pieces if p.index in peer_pieces]
-        if not candidates: return None
-        candidates.sort(key=lambda p: sum(1 for peers in self.peers.values() if p.index in peers))
-        piece = candidates[0]
-        self.missing_pieces.remove(piece)
-        self.ongoing_pieces.append(piece)
+            for piece in self.ongoing_pieces.values():
+                if (mask >> (top - piece.index)) & 1:
+                    i = piece.statuses.find(Block.Pending)
+                    if i >= 0: return piece.blocks[i]
+        # Rarest-first in one pass (seeds left out of the counts). A piece no
+        # other non-seed has cannot be beaten, so the scan stops there.
+        rarity = self._rarity
+        floor = 0 if peer_id in self._seed_ids else 1
+        piece, best = None, None
+        # Nothing this peer has is still missing: skip the scan
+        if not mask & self._missing_mask: return None
+        for p in self.missing_pieces.values():
+            if (mask >> (top - p.index)) & 1:
+                count = rarity[p.index]
+                if best is None or count < best:
+                    piece, best = p, count
+                    if count <= floor: break
+        if piece is None: return None
+        del self.missing_pieces[piece.index]
+        self._missing_mask &= ~(1 << (top - piece.index))
+        self.ongoing_pieces[piece.index] = piece
         block = piece.blocks[0]
         block.status = Block.Pending
-        self.pending_blocks.append((block, current_time))
+        self.pending_blocks[(piece.index, block.offset)] = (block, current_time)
         return block
 
     def block_received(self, peer_id, piece_index, block_offset, data):
-        self.pending_blocks = [x for x in self.pending_blocks if not (x[0].piece_index == piece_index and x[0].offset == block_offset)]
-        target_piece = next((p for p in self.ongoing_pieces if p.index == piece_index), None)
+        self.pending_blocks.pop((piece_index, block_offset), None)
+        target_piece = self.ongoing_pieces.get(piece_index)
         if not target_piece: return
-        target_block = next((b for b in target_piece.blocks if b.offset == block_offset), None)
-        if target_block:
-            target_block.status = Block.Retrieved
-            target_block.data = data
-        if all(b.status == Block.Retrieved for b in target_piece.blocks):
+        # Blocks sit at fixed BLOCK_SIZE offsets, so the offset gives the slot
+        slot, misaligned = divmod(block_offset, BLOCK_SIZE)
+        if not misaligned and 0 <= slot < target_piece.num_blocks:
+            target_block = target_piece.blocks[slot]
+            # End game: a duplicate must not be hashed twice
+            if target_block.status == Block.Retrieved: return
+            # A short/long block would shift the rest of the piece buffer.
+            # Its pending entry is gone, so hand it out again right away.
+            if len(data) != target_block.length:
+                target_block.status = Block.Missing
+                return
+            target_piece.store(target_block, data)
+            target_piece.hash_received()
+        # Every block is in once the hashed prefix covers the whole piece
+        if target_piece._hashed == target_piece.num_blocks:
             self._validate_piece(target_piece)
 
     def _validate_piece(self, piece):
-        raw_data = piece.data
-        if not raw_data: return
-        hashed = hashlib.sha1(raw_data).digest()
-        if hashed == piece.hash:
+        hashed = piece.digest()
+        if hashed is None: return
+        if hashed == self._hash_of(piece.index):
+            raw_data = piece.data
+            piece.release() # The buffer is owned by the write cache from here on
             try:
                 loop = asyncio.get_running_loop()
                 loop.create_task(self._write_async(piece, raw_data))
             except RuntimeError:
                 # Sync fallback for tests if loop isn't running
                 pass 
-            self.ongoing_pieces.remove(piece)
+            del self.ongoing_pieces[piece.index]
             self.have_pieces.append(piece)
+            self._have_set.add(piece.index)
+            self._have_mask |= 1 << (self._top - piece.index)
             piece.is_complete = True
             self.downloaded_bytes += len(raw_data)
-            logging.info(f"Piece {piece.index} verified.")
+            logging.info("Piece %d verified.", piece.index)
         else:
-            logging.warning(f"Piece {piece.index} hash mismatch.")
+            logging.warning("Piece %d hash mismatch.", piece.index)
             piece.reset()
-            self.ongoing_pieces.remove(piece)
-            self.missing_pieces.insert(0, piece) 
+            del self.ongoing_pieces[piece.index]
+            # Back at the front so it wins rarest-first ties (rare: a copy per failure)
+            self.missing_pieces = {piece.index: piece, **self.missing_pieces}
+            self._missing_mask |= 1 << (self._top - piece.index)
+
+    def _hash_of(self, index):
+        return self._piece_hashes[index * 20:index * 20 + 20]
 
     async def _write_async(self, piece, data):
-        await self.file_manager.write(piece.index * self.torrent.piece_length, data)
+        await self.file_manager.write(piece.byte_offset, data)
 
     async def read_block(self, piece_index, block_offset, length):
-        has_piece = any(p.index == piece_index for p in self.have_pieces)
-        if has_piece:
-            global_offset = (piece_index * self.torrent.piece_length) + block_offset
+        if piece_index in self._have_set:
+            global_offset = (piece_index * self._piece_length) + block_offset
             return await self.file_manager.read(global_offset, length)
         return None
 
+    def block_source(self, piece_index, block_offset, length):
+        """
+        (file, offset) for sending a verified block straight from disk, or None.
+        """
+        if piece_index not in self._have_set: return None
+        global_offset = (piece_index * self._piece_length) + block_offset
+        return self.file_manager.file_region(global_offset, length)
+
     @property
     def complete(self):
         return len(self.have_pieces) == self.total_pieces
\ No newline at end of file
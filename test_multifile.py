@@ -1,6 +1,7 @@
 import unittest
 import os
 import shutil
+import hashlib
 from unittest.mock import MagicMock
 from torrent import Torrent, TorrentFile
 from file_manager import FileManager
@@ -94,5 +95,46 @@ class TestMultiFileSupport(unittest.TestCase):
         with open(self.f3_path, 'rb') as f:
             self.assertEqual(f.read(2), b'ZZ')
 
+    def test_file_region(self):
+        # Inside File C
+        f, offset = self.fm.file_region(17, 5)
+        self.assertEqual(f.name, self.f3_path)
+        self.assertEqual(offset, 2)
+        # Spans File A and File B: not sendable as one region
+        self.assertIsNone(self.fm.file_region(8, 4))
+        # Still in the write cache, not on disk yet
+        self.fm.write_cache[15] = b'C' * 10
+        self.assertIsNone(self.fm.file_region(17, 5))
+        self.fm.write_cache.clear()
+
+    def test_flush_coalesces_adjacent_writes(self):
+        # 15-25 is one run inside File C; 8-12 spans File A and File B
+        self.fm.write_cache = {20: b'D' * 5, 15: b'C' * 5, 8: b'X' * 2, 10: b'Y' * 2}
+        self.fm._flush_sync()
+
+        with open(self.f3_path, 'rb') as f: self.assertEqual(f.read(), b'CCCCCDDDDD')
+        with open(self.f1_path, 'rb') as f: self.assertEqual(f.read()[8:], b'XX')
+        with open(self.f2_path, 'rb') as f: self.assertEqual(f.read(2), b'YY')
+        self.assertEqual(self.fm.write_cache, {})
+
+    def test_hash_range_across_files(self):
+        data = bytes(range(25))
+        self.fm._write_to_disk_sync(0, data)
+
+        sha1 = hashlib.sha1()
+        self.assertEqual(self.fm.hash_range_sync(5, 15, sha1), 15)
+        self.assertEqual(sha1.digest(), hashlib.sha1(data[5:20]).digest())
+
+    def test_hash_range_ignores_oversized_file(self):
+        # A leftover file A, longer than the torrent says, is never truncated
+        self.fm.close()
+        with open(self.f1_path, 'wb') as f: f.write(b'A' * 10 + b'Z' * 10)
+        with open(self.f2_path, 'wb') as f: f.write(b'B' * 5)
+        self.fm = FileManager(self.torrent)
+
+        sha1 = hashlib.sha1()
+        self.assertEqual(self.fm.hash_range_sync(5, 10, sha1), 10)
+        self.assertEqual(sha1.digest(), hashlib.sha1(b'AAAAABBBBB').digest())
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
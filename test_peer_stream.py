@@ -0,0 +1,84 @@
+import unittest
+import asyncio
+import struct
+from peer_stream import PeerStream, RECV_HIGH_WATER
+
+class TestPeerStream(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.big = bytes(range(256)) * ((RECV_HIGH_WATER * 2) // 256)
+        self.server = await asyncio.start_server(self.handle_client, '127.0.0.1', 8890)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        try:
+            # Echo one framed message, then push a payload larger than the buffer
+            length = struct.unpack(">I", await reader.readexactly(4))[0]
+            writer.write(struct.pack(">I", length) + await reader.readexactly(length))
+            writer.write(self.big)
+            writer.write(b'tail')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _connect(self, read_timeout=None):
+        loop = asyncio.get_running_loop()
+        _, stream = await loop.create_connection(lambda: PeerStream(read_timeout), '127.0.0.1', 8890)
+        return stream
+
+    async def test_framing_and_growth(self):
+        stream = await self._connect()
+        # Record flow control on the real transport
+        events = []
+        transport = stream.transport
+        pause, resume = transport.pause_reading, transport.resume_reading
+        transport.pause_reading = lambda: (events.append('pause'), pause())
+        transport.resume_reading = lambda: (events.append('resume'), resume())
+        stream.write(struct.pack(">I", 5))
+        stream.writelines([b'he', b'llo'])
+        await stream.drain()
+
+        (length,) = await stream.readstruct(struct.Struct(">I"))
+        self.assertEqual(await stream.readexactly(length), b'hello')
+
+        # Let the sender overrun the high-water mark before we read
+        await asyncio.sleep(0.1)
+        data = await stream.readexactly(len(self.big))
+        self.assertEqual(data, self.big)
+        # The buffer grew to hold the whole message, and the socket was
+        # paused past the high-water mark, then resumed for the read
+        self.assertGreaterEqual(len(stream._buf), len(self.big))
+        self.assertEqual(events[:2], ['pause', 'resume'])
+        stream.close()
+
+    async def test_incomplete_read_at_eof(self):
+        stream = await self._connect()
+        stream.write(struct.pack(">I", 0))
+        await stream.readexactly(4 + len(self.big))
+        with self.assertRaises(asyncio.IncompleteReadError) as ctx:
+            await stream.readexactly(10)
+        self.assertEqual(ctx.exception.partial, b'tail')
+        self.assertEqual(await stream.read(10), b'')
+        stream.close()
+
+    async def test_read_timeout_when_idle(self):
+        # Server waits for our request, so nothing arrives
+        stream = await self._connect(read_timeout=0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await stream.readexactly(1)
+        # Nothing was consumed; the stream is still usable
+        stream.write(struct.pack(">I", 0))
+        self.assertEqual(await stream.readexactly(4), struct.pack(">I", 0))
+        stream.close()
+
+    async def test_drain_after_clean_close_raises(self):
+        stream = PeerStream()
+        stream.pause_writing()
+        stream.connection_lost(None)
+        with self.assertRaises(ConnectionResetError):
+            await asyncio.wait_for(stream.drain(), timeout=1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,14 @@ class TestBencoding(unittest.TestCase):
         self.assertEqual(res[b'cow'], b'moo')
         self.assertEqual(res[b'spam'], b'eggs')
 
+    def test_consumed_marks_end_of_value(self):
+        # ut_metadata data messages append raw bytes after the dict
+        header = b'd8:msg_typei1e5:piecei0ee'
+        decoder = Decoder(header + b'RAWDATA')
+        res = decoder.decode()
+        self.assertEqual(res[b'piece'], 0)
+        self.assertEqual(decoder.consumed, len(header))
+
     def test_encode_complex(self):
         # Reproduce the complex example from PDF Page 2
         data = [b'spam', b'eggs', 123]
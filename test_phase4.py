@@ -2,8 +2,9 @@ import unittest
 import asyncio
 import struct
 import message
-from peer import PeerConnection
-from unittest.mock import MagicMock
+from peer import PeerConnection, PIPELINE_DEPTH
+from unittest.mock import MagicMock, AsyncMock
+from piece_manager import Block
 
 class TestPeerProtocol(unittest.TestCase):
     def test_handshake_encoding(self):
@@ -20,6 +21,68 @@ class TestPeerProtocol(unittest.TestCase):
         encoded = msg.encode()
         self.assertEqual(encoded, b'\x00\x00\x00\x01\x01')
 
+class TestMessageFraming(unittest.IsolatedAsyncioTestCase):
+    async def test_keep_alives_between_messages(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(struct.pack(">I", 0) + struct.pack(">I", 0))  # two keep-alives
+        reader.feed_data(message.PeerMessage(message.CHOKE).encode())
+        reader.feed_data(struct.pack(">I", 0))
+        reader.feed_data(message.PeerMessage(message.HAVE, struct.pack(">I", 7)).encode())
+        reader.feed_eof()
+
+        pm_mock = MagicMock()
+        pc = PeerConnection(asyncio.Queue(), pm_mock, b'\xAA' * 20, b'\x00' * 20, enable_mse=False)
+        pc.reader = reader
+        pc.peer_choking = False
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await pc._read_loop()
+
+        self.assertTrue(pc.peer_choking)
+        pm_mock.update_peer.assert_called_once_with(None, 7)
+
+    async def test_oversized_length_drops_peer(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(struct.pack(">IB", 0xFFFFFFFF, message.PIECE))
+
+        pc = PeerConnection(asyncio.Queue(), MagicMock(), b'\xAA' * 20, b'\x00' * 20, enable_mse=False)
+        pc.reader = reader
+        # Must fail on the header, not wait for 4GB that never comes
+        with self.assertRaises(ConnectionError):
+            await asyncio.wait_for(pc._read_loop(), timeout=1)
+
+    async def test_malformed_have_drops_peer(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(message.PeerMessage(message.HAVE).encode()) # No index
+
+        pm_mock = MagicMock()
+        pc = PeerConnection(asyncio.Queue(), pm_mock, b'\xAA' * 20, b'\x00' * 20, enable_mse=False)
+        pc.reader = reader
+        with self.assertRaises(ConnectionError):
+            await asyncio.wait_for(pc._read_loop(), timeout=1)
+        pm_mock.update_peer.assert_not_called()
+
+class TestRequestPipelining(unittest.IsolatedAsyncioTestCase):
+    async def test_requests_are_batched_up_to_depth(self):
+        blocks = [Block(0, i * 16384, 16384) for i in range(8)]
+        pm_mock = MagicMock()
+        pm_mock.next_request.side_effect = blocks + [None]
+        pc = PeerConnection(asyncio.Queue(), pm_mock, b'\xAA' * 20, b'\x00' * 20, enable_mse=False)
+        pc.writer = MagicMock()
+        pc.writer.drain = AsyncMock()
+        pc.peer_choking = False
+
+        pc._request_piece()
+
+        frames = pc.writer.writelines.call_args[0][0]
+        self.assertEqual(len(frames), PIPELINE_DEPTH)
+        self.assertEqual(frames[1], message.Request(0, 16384, 16384).encode())
+        # Tiny control frames don't wait on drain()
+        pc.writer.drain.assert_not_awaited()
+
+        # A PIECE frees one slot, which is refilled on the next call
+        await pc._on_piece(struct.pack(">II", 0, 0) + b'x' * 16384)
+        self.assertEqual(len(pc.writer.writelines.call_args[0][0]), 1)
+
 class TestPeerCommunication(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
         self.server_info_hash = b'\xAA' * 20
@@ -2,6 +2,7 @@ import unittest
 import os
 import hashlib
 import asyncio
+import time
 from piece_manager import PieceManager, Block
 from torrent import Torrent, TorrentFile
 from unittest.mock import MagicMock
@@ -42,9 +43,71 @@ class TestPieceManager(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(block.piece_index, 0)
         
         self.pm.block_received("peer1", 0, 0, b'a' * 16384)
-        p0 = next(p for p in self.pm.ongoing_pieces if p.index == 0)
+        p0 = self.pm.ongoing_pieces[0]
         self.assertEqual(p0.blocks[0].status, Block.Retrieved)
 
+    async def test_recheck_finds_existing_piece(self):
+        self.pm.close()
+        with open("test_output.bin", "r+b") as f: f.write(self.data_p0)
+
+        self.pm = PieceManager(self.torrent)
+        self.assertEqual([p.index for p in self.pm.have_pieces], [0])
+        self.assertEqual(list(self.pm.missing_pieces), [1])
+        self.assertIsNone(self.pm.have_pieces[0]._blocks) # Never scheduled, never built
+        self.assertEqual(self.pm.downloaded_bytes, 32768)
+        # A peer with only piece 0 has nothing we need
+        self.pm.add_peer("peer2", b'\x80')
+        self.assertIsNone(self.pm.next_request("peer2"))
+
+    async def test_resume_data_round_trip(self):
+        self.pm.next_request("peer1")
+        self.pm.next_request("peer1")
+        self.pm.block_received("peer1", 0, 0, self.data_p0[:16384])
+        self.pm.block_received("peer1", 0, 16384, self.data_p0[16384:])
+        self.pm.close()
+        try:
+            with open(self.pm.resume_file, 'rb') as f: self.assertEqual(f.read(), b'\x80')
+            self.pm = PieceManager(self.torrent)
+            self.assertEqual([p.index for p in self.pm.have_pieces], [0])
+        finally:
+            os.remove(self.pm.resume_file)
+
+    async def test_rarest_piece_first(self):
+        # peer1 has both pieces; peer2 only piece 0, so piece 1 is rarer
+        self.pm.add_peer("peer2", b'\x80')
+        self.assertEqual(self.pm.next_request("peer1").piece_index, 1)
+
+        self.pm.remove_peer("peer2")
+        self.pm.update_peer("peer3", 1)
+        self.pm.update_peer("peer3", 1) # Repeated HAVE counts once
+        self.assertEqual(self.pm.availability(0), 1)
+        self.assertEqual(self.pm.availability(1), 2)
+        self.assertEqual(self.pm._seed_ids, {"peer1"})
+
+    async def test_expired_block_requested_again(self):
+        first = self.pm.next_request("peer1")
+        second = self.pm.next_request("peer1")
+        # Age the first request past the timeout
+        self.pm.pending_blocks[(0, 0)] = (first, time.monotonic() - 10)
+
+        self.assertIs(self.pm.next_request("peer1"), first)
+        self.assertEqual(list(self.pm.pending_blocks), [(0, second.offset), (0, 0)])
+
+    async def test_wrong_length_block_ignored(self):
+        self.pm.next_request("peer1")
+        self.pm.block_received("peer1", 0, 0, b'a' * 100)
+        p0 = self.pm.ongoing_pieces[0]
+        self.assertNotEqual(p0.blocks[0].status, Block.Retrieved)
+        self.assertEqual(len(p0._buf or b''), 0)
+        # The rejected block is requested again, not left pending forever
+        self.assertIs(self.pm.next_request("peer1"), p0.blocks[0])
+
+    async def test_misaligned_block_ignored(self):
+        self.pm.next_request("peer1")
+        self.pm.block_received("peer1", 0, 100, b'a' * 16384)
+        self.pm.block_received("peer1", 0, 32768, b'a' * 16384) # Past the piece
+        self.assertEqual(bytes(self.pm.ongoing_pieces[0].statuses), bytes((Block.Pending, Block.Missing)))
+
     async def test_integrity_check_success(self):
         self.pm.next_request("peer1")
         self.pm.next_request("peer1")
@@ -64,6 +127,31 @@ class TestPieceManager(unittest.IsolatedAsyncioTestCase):
             content = f.read(32768)
             self.assertEqual(content, self.data_p0)
 
+    async def test_integrity_check_with_memoryview_blocks(self):
+        # PeerConnection hands over views into the received PIECE payload
+        self.pm.next_request("peer1")
+        self.pm.next_request("peer1")
+
+        payload = b'\x00' * 8 + self.data_p0
+        self.pm.block_received("peer1", 0, 0, memoryview(payload)[8:16392])
+        self.pm.block_received("peer1", 0, 16384, memoryview(payload)[16392:])
+
+        self.assertEqual(len(self.pm.have_pieces), 1)
+        # Nothing per-download is kept once the piece is verified
+        self.assertIsNone(self.pm.have_pieces[0]._buf)
+        self.assertIsNone(self.pm.have_pieces[0]._sha1)
+
+    async def test_integrity_check_out_of_order_blocks(self):
+        self.pm.next_request("peer1")
+        self.pm.next_request("peer1")
+
+        self.pm.block_received("peer1", 0, 16384, self.data_p0[16384:])
+        p0 = self.pm.ongoing_pieces[0]
+        self.assertEqual(p0._hashed, 0) # Waits for the first block
+        self.pm.block_received("peer1", 0, 0, self.data_p0[:16384])
+
+        self.assertEqual(len(self.pm.have_pieces), 1)
+
     async def test_integrity_check_failure(self):
         self.pm.next_request("peer1")
         self.pm.next_request("peer1")
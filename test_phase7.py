@@ -2,10 +2,10 @@ import unittest
 import asyncio
 import struct
 import socket
-from peer import PeerConnection
+from peer import PeerConnection, PeerQueue
 from message import ExtendedHandshake, ExtendedMessage
 from bencoding import Encoder
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 class TestExtensionProtocol(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
@@ -86,7 +86,36 @@ class TestExtensionProtocol(unittest.IsolatedAsyncioTestCase):
             
         self.assertEqual(queue.qsize(), 1)
         new_peer = await queue.get()
-        self.assertEqual(new_peer, ("1.2.3.4", 5555))
+        # PEX peers are queued with packed IPs
+        self.assertEqual(new_peer, (socket.inet_aton("1.2.3.4"), 5555))
+
+class TestPexParsing(unittest.TestCase):
+    def test_compact_peers_are_queued_packed(self):
+        queue = asyncio.Queue()
+        pc = PeerConnection(queue, MagicMock(), b'i'*20, b'p'*20)
+        pc._parse_and_add_peers(socket.inet_aton("1.2.3.4") + struct.pack(">H", 5555) +
+                                socket.inet_aton("10.0.0.1") + struct.pack(">H", 6881))
+        self.assertEqual([queue.get_nowait() for _ in range(queue.qsize())],
+                         [(socket.inet_aton("1.2.3.4"), 5555), (socket.inet_aton("10.0.0.1"), 6881)])
+        # A truncated list is dropped whole
+        pc._parse_and_add_peers(socket.inet_aton("1.2.3.4"))
+        self.assertTrue(queue.empty())
+
+class TestPeerQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_skips_already_connected_peer(self):
+        queue = PeerQueue()
+        queue.connected.add(("1.2.3.4", 1))
+        conn = PeerConnection(queue, MagicMock(), b'i'*20, b'p'*20)
+        conn._connect_and_loop = AsyncMock()
+        queue.put_nowait(("1.2.3.4", 1))
+        queue.put_nowait(("5.6.7.8", 2))
+
+        worker = asyncio.create_task(conn.run())
+        await asyncio.wait_for(queue.join(), timeout=1)
+        worker.cancel()
+
+        conn._connect_and_loop.assert_awaited_once()
+        self.assertEqual(queue.connected, {("1.2.3.4", 1)})
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
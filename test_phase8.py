@@ -1,8 +1,10 @@
 import unittest
+import os
 import asyncio
 import struct
 import message
-from peer import PeerConnection
+from peer import PeerConnection, _CHOKE_FRAME
+from peer_stream import PeerStream
 from unittest.mock import MagicMock
 
 class TestUploading(unittest.IsolatedAsyncioTestCase):
@@ -11,8 +13,10 @@ class TestUploading(unittest.IsolatedAsyncioTestCase):
         self.server_peer_id = b'-PC0001-000000000000'
         self.server = await asyncio.start_server(self.handle_client, '127.0.0.1', 8888)
         self.server_task = asyncio.create_task(self.server.serve_forever())
+        self.upload_file = "test_upload_source.bin"
 
     async def asyncTearDown(self):
+        if os.path.exists(self.upload_file): os.remove(self.upload_file)
         self.server.close()
         await self.server.wait_closed()
         self.server_task.cancel()
@@ -57,7 +61,7 @@ class TestUploading(unittest.IsolatedAsyncioTestCase):
             if resp_id == message.PIECE:
                 self.piece_received = True
             
-            await reader.read(resp_len - 9)
+            self.piece_data = await reader.readexactly(resp_len - 9)
             
             await asyncio.sleep(0.1)
         except Exception:
@@ -75,6 +79,7 @@ class TestUploading(unittest.IsolatedAsyncioTestCase):
         future = asyncio.Future()
         future.set_result(b'A' * 16384)
         pm.read_block.return_value = future
+        pm.block_source.return_value = None # Not on disk: use read_block
         
         # DISABLE MSE
         pc = PeerConnection(queue, pm, self.server_info_hash, b'-PC0001-TEST00000000', enable_mse=False)
@@ -90,6 +95,76 @@ class TestUploading(unittest.IsolatedAsyncioTestCase):
             pass
             
         self.assertTrue(self.piece_received, "Client did not send PIECE response to REQUEST")
+        self.assertEqual(self.piece_data, b'A' * 16384)
+
+    async def test_uploading_via_sendfile(self):
+        self.piece_received = False
+        self.piece_data = None
+        queue = asyncio.Queue()
+        queue.put_nowait(('127.0.0.1', 8888))
+
+        with open(self.upload_file, 'wb') as f:
+            f.write(b'x' * 100 + b'B' * 16384)
+        source = open(self.upload_file, 'rb')
+        pm = MagicMock()
+        pm.block_source.return_value = (source, 100)
+
+        pc = PeerConnection(queue, pm, self.server_info_hash, b'-PC0001-TEST00000000', enable_mse=False)
+        task = asyncio.create_task(pc.run())
+        await asyncio.sleep(1.0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        source.close()
+
+        self.assertTrue(self.piece_received)
+        self.assertEqual(self.piece_data, b'B' * 16384)
+        pm.read_block.assert_not_called()
+
+class TestChokeDuringSendfile(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.upload_file = "test_sendfile_source.bin"
+        self.size = 8 * 1024 * 1024 # Far more than the socket buffers hold
+        with open(self.upload_file, 'wb') as f: f.write(b'C' * self.size)
+        self.start_reading = asyncio.Event()
+        self.received = asyncio.get_running_loop().create_future()
+        self.server = await asyncio.start_server(self.handle_client, '127.0.0.1', 8889)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.upload_file): os.remove(self.upload_file)
+
+    async def handle_client(self, reader, writer):
+        # Don't read until the test has choked mid-transfer
+        await self.start_reading.wait()
+        self.received.set_result(await reader.readexactly(13 + self.size + len(_CHOKE_FRAME)))
+        writer.close()
+
+    async def test_choke_is_held_until_sendfile_returns(self):
+        loop = asyncio.get_running_loop()
+        _, stream = await loop.create_connection(PeerStream, '127.0.0.1', 8889)
+        pc = PeerConnection(asyncio.Queue(), MagicMock(), b'\xAA' * 20, b'-PC0001-TEST00000000', enable_mse=False)
+        pc.writer = pc._stream = stream
+        pc.am_choking = False
+
+        with open(self.upload_file, 'rb') as source:
+            upload = asyncio.create_task(pc._sendfile_block(0, 0, self.size, source, 0))
+            await asyncio.sleep(0.2)
+            self.assertFalse(upload.done())
+            pc.choke() # Must not hit the transport while sendfile owns it
+            self.assertFalse(pc.am_choking) # Not sent yet
+            self.start_reading.set()
+            await upload
+
+        self.assertTrue(pc.am_choking)
+        data = await asyncio.wait_for(self.received, 5)
+        self.assertEqual(data[4], message.PIECE)
+        self.assertEqual(data[13:13 + self.size], b'C' * self.size)
+        self.assertEqual(data[13 + self.size:], _CHOKE_FRAME)
+        stream.close()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file